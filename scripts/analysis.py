@@ -0,0 +1,357 @@
+"""
+Out-of-core analysis of binary trajectory files.
+
+Snapshots are streamed from disk in chunks (see trajectory.py), each chunk
+is reduced to a small partial summary with vectorized numpy maths, and the
+partial summaries are merged into compact tables:
+
+    bodies : mean semi-major axis, eccentricity range, inclination and
+             orbital period of each body about the primary
+    pairs  : closest approach of each pair of bodies and the number of
+             snapshots spent inside a threshold distance
+    evol   : mean eccentricity of each body in each chunk of the run
+
+Contiguous ranges of the file can be analysed in parallel across a
+process pool, since each range only needs its own chunks.
+
+To use:
+
+`python analysis.py run.traj --workers 4 --output run`
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import constants as C
+import trajectory
+
+
+def orbital_elements(pos, vel, masses, primary=0):
+    """
+    Osculating orbital elements of each body about the primary.
+
+    Parameters
+    ----------
+    pos : numpy.array (k, N, 3)
+        The positions of the bodies in k snapshots.
+        Unit: m
+    vel : numpy.array (k, N, 3)
+        The velocities of the bodies in k snapshots.
+        Unit: m/s
+    masses : numpy.array (N,)
+        The mass of each body.
+        Unit: kg
+    primary : int
+        The index of the body the orbits are measured around.
+
+    Returns
+    -------
+    a : numpy.array (k, N)
+        Semi-major axis, negative for unbound orbits.
+        Unit: m
+    e : numpy.array (k, N)
+        Eccentricity.
+    inc : numpy.array (k, N)
+        Inclination to the x-y plane.
+        Unit: radians
+    period : numpy.array (k, N)
+        Orbital period, NaN for unbound orbits.
+        Unit: s
+
+    The primary itself has NaN for every element.
+    """
+    r = pos - pos[:, primary:primary+1]
+    v = vel - vel[:, primary:primary+1]
+    mu = C.XG * (masses[primary] + masses)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rnorm = np.linalg.norm(r, axis=-1)
+        energy = 0.5 * np.sum(v**2, axis=-1) - mu / rnorm
+        a = -mu / (2 * energy)
+
+        h = np.cross(r, v)
+        hnorm = np.linalg.norm(h, axis=-1)
+        evec = np.cross(v, h) / mu[:, None] - r / rnorm[..., None]
+        e = np.linalg.norm(evec, axis=-1)
+        inc = np.arccos(np.clip(h[..., 2] / hnorm, -1, 1))
+
+        period = np.where(a > 0, 2 * np.pi * np.sqrt(np.abs(a)**3 / mu), np.nan)
+
+    for x in (a, e, inc, period):
+        x[:, primary] = np.nan
+
+    return a, e, inc, period
+
+
+def pair_separations(pos):
+    """
+    Distance between every pair of bodies.
+
+    Parameters
+    ----------
+    pos : numpy.array (k, N, 3)
+        The positions of the bodies in k snapshots.
+        Unit: m
+
+    Returns
+    -------
+    pairs : (numpy.array (P,), numpy.array (P,))
+        The indices i < j of each pair.
+    dist : numpy.array (k, P)
+        The separation of each pair in each snapshot.
+        Unit: m
+    """
+    i, j = np.triu_indices(pos.shape[1], k=1)
+    dist = np.linalg.norm(pos[:, i] - pos[:, j], axis=-1)
+
+    return (i, j), dist
+
+
+def _stats(x):
+    """
+    Sum, count, min and max over the first axis, ignoring NaN.
+    """
+    finite = np.isfinite(x)
+    return {"sum": np.where(finite, x, 0).sum(axis=0),
+            "n": finite.sum(axis=0),
+            "min": np.where(finite, x, np.inf).min(axis=0),
+            "max": np.where(finite, x, -np.inf).max(axis=0)}
+
+
+def _merge_stats(s1, s2):
+    return {"sum": s1["sum"] + s2["sum"],
+            "n": s1["n"] + s2["n"],
+            "min": np.minimum(s1["min"], s2["min"]),
+            "max": np.maximum(s1["max"], s2["max"])}
+
+
+def summarise_chunks(chunks, masses, primary=0, threshold=10 * C.XRSUN):
+    """
+    Reduces each chunk of snapshots to a partial summary.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Chunks of (time, pos, vel) as yielded by trajectory.read_chunks.
+    masses : numpy.array (N,)
+        The mass of each body.
+        Unit: kg
+    primary : int
+        The index of the body the orbits are measured around.
+    threshold : float
+        Pairs closer than this count as a close approach.
+        Unit: m
+
+    Yields
+    ------
+    partial : dict
+        Summary of the chunk that can be combined with merge_summaries.
+    """
+    for time, pos, vel in chunks:
+        a, e, inc, period = orbital_elements(pos, vel, masses, primary)
+        _, dist = pair_separations(pos)
+
+        imin = np.argmin(dist, axis=0)
+        estats = _stats(e)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            emean = estats["sum"] / estats["n"]
+
+        yield {"a": _stats(np.where(a > 0, a, np.nan)),
+               "e": estats,
+               "inc": _stats(inc),
+               "period": _stats(period),
+               "dmin": dist[imin, np.arange(dist.shape[1])],
+               "tmin": time[imin],
+               "nclose": np.sum(dist < threshold, axis=0),
+               "evol": np.concatenate([[time[0], time[-1]], emean])[None]}
+
+
+def merge_summaries(partials):
+    """
+    Combines partial summaries in time order into a single summary.
+
+    Parameters
+    ----------
+    partials : iterable
+        Partial summaries from summarise_chunks or merge_summaries.
+
+    Returns
+    -------
+    summary : dict
+        The combined summary, or None if there were no partials.
+    """
+    summary = None
+    for p in partials:
+        if summary is None:
+            summary = p
+            continue
+
+        closer = p["dmin"] < summary["dmin"]
+        summary = {"a": _merge_stats(summary["a"], p["a"]),
+                   "e": _merge_stats(summary["e"], p["e"]),
+                   "inc": _merge_stats(summary["inc"], p["inc"]),
+                   "period": _merge_stats(summary["period"], p["period"]),
+                   "dmin": np.where(closer, p["dmin"], summary["dmin"]),
+                   "tmin": np.where(closer, p["tmin"], summary["tmin"]),
+                   "nclose": summary["nclose"] + p["nclose"],
+                   "evol": np.concatenate([summary["evol"], p["evol"]])}
+
+    return summary
+
+
+def analyse_range(filename, start, stop, chunk=10000, primary=0,
+                  threshold=10 * C.XRSUN):
+    """
+    Summarises a contiguous range of snapshots of a trajectory file.
+
+    This is the unit of work handed to each process in the pool.
+    """
+    masses, _, _ = trajectory.read_header(filename)
+    chunks = trajectory.read_chunks(filename, chunk, start, stop)
+
+    return merge_summaries(summarise_chunks(chunks, masses, primary, threshold))
+
+
+def analyse(filename, chunk=10000, workers=1, primary=0, threshold=10 * C.XRSUN):
+    """
+    Streams a trajectory file and reduces it to summary tables.
+
+    Parameters
+    ----------
+    filename : str
+        The trajectory file.
+    chunk : int
+        The number of snapshots held in memory at a time by each worker.
+    workers : int
+        The number of processes to analyse the file with.
+    primary : int
+        The index of the body the orbits are measured around.
+    threshold : float
+        Pairs closer than this count as a close approach.
+        Unit: m
+
+    Returns
+    -------
+    bodies : numpy.array
+        Structured array with one row per body.
+    pairs : numpy.array
+        Structured array with one row per pair of bodies.
+    evol : numpy.array (nchunks, 2 + N)
+        Start time, end time (yr) and mean eccentricity of each body
+        in each chunk.
+    """
+    masses, _, nrec = trajectory.read_header(filename)
+    if nrec == 0:
+        raise ValueError("{0} contains no snapshots".format(filename))
+
+    if workers > 1:
+        # Split the file into chunk aligned ranges, a few per worker
+        nranges = min(4 * workers, -(-nrec // chunk))
+        bounds = np.linspace(0, -(-nrec // chunk), nranges + 1).astype(int) * chunk
+        bounds[-1] = nrec
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(analyse_range, filename, start, stop,
+                                   chunk, primary, threshold)
+                       for start, stop in zip(bounds[:-1], bounds[1:])
+                       if stop > start]
+            summary = merge_summaries(f.result() for f in futures)
+    else:
+        summary = analyse_range(filename, 0, nrec, chunk, primary, threshold)
+
+    return summary_tables(summary, masses)
+
+
+def summary_tables(summary, masses):
+    """
+    Converts a merged summary into compact tables.
+
+    Lengths are given in Rsun, times in years and angles in degrees.
+    """
+    def mean(stats):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(stats["n"] > 0, stats["sum"] / stats["n"], np.nan)
+
+    def extreme(stats, key):
+        return np.where(stats["n"] > 0, stats[key], np.nan)
+
+    N = len(masses)
+    bodies = np.zeros(N, dtype=[("body", int), ("mass", float),
+                                ("a_mean", float), ("e_mean", float),
+                                ("e_min", float), ("e_max", float),
+                                ("inc_mean", float), ("period_mean", float)])
+    bodies["body"] = np.arange(N)
+    bodies["mass"] = masses / C.XMSUN
+    bodies["a_mean"] = mean(summary["a"]) / C.XRSUN
+    bodies["e_mean"] = mean(summary["e"])
+    bodies["e_min"] = extreme(summary["e"], "min")
+    bodies["e_max"] = extreme(summary["e"], "max")
+    bodies["inc_mean"] = np.degrees(mean(summary["inc"]))
+    bodies["period_mean"] = mean(summary["period"]) / C.XYR
+
+    i, j = np.triu_indices(N, k=1)
+    pairs = np.zeros(len(i), dtype=[("i", int), ("j", int), ("d_min", float),
+                                    ("t_min", float), ("n_close", int)])
+    pairs["i"] = i
+    pairs["j"] = j
+    pairs["d_min"] = summary["dmin"] / C.XRSUN
+    pairs["t_min"] = summary["tmin"] / C.XYR
+    pairs["n_close"] = summary["nclose"]
+
+    evol = summary["evol"].copy()
+    evol[:, :2] /= C.XYR
+
+    return bodies, pairs, evol
+
+
+def write_tables(bodies, pairs, evol, prefix):
+    """
+    Writes the summary tables to <prefix>_bodies.csv, <prefix>_pairs.csv
+    and <prefix>_evol.csv.
+    """
+    for table, name in ((bodies, "bodies"), (pairs, "pairs")):
+        fmt = ["%d" if table.dtype[k].kind == "i" else "%.8g"
+               for k in table.dtype.names]
+        np.savetxt("{0}_{1}.csv".format(prefix, name), table, fmt=fmt,
+                   delimiter=",", header=",".join(table.dtype.names))
+
+    header = ",".join(["t_start", "t_end"] +
+                      ["e{0}".format(k) for k in range(evol.shape[1] - 2)])
+    np.savetxt("{0}_evol.csv".format(prefix), evol, fmt="%.8g",
+               delimiter=",", header=header)
+
+
+def read_args():
+    """
+    Read the arguments specified by the user.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="The trajectory file to analyse.")
+    parser.add_argument("--chunk", help="The number of snapshots read at \
+                        a time. Default: 10000", type=int, default=10000)
+    parser.add_argument("--workers", help="The number of processes to \
+                        use. Default: 1", type=int, default=1)
+    parser.add_argument("--primary", help="The index of the body orbits \
+                        are measured around. Default: 0", type=int, default=0)
+    parser.add_argument("--threshold", help="Close approach distance. \
+                        Unit: solar radii, Default: 10", type=float, default=10)
+    parser.add_argument("--output", help="Prefix of the output tables. \
+                        Default: the trajectory filename.")
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = read_args()
+
+    bodies, pairs, evol = analyse(args.filename, args.chunk, args.workers,
+                                  args.primary, args.threshold * C.XRSUN)
+
+    write_tables(bodies, pairs, evol, args.output or args.filename)
+
+
+if __name__ == '__main__':
+    main()
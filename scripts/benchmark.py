@@ -0,0 +1,326 @@
+"""
+Work-precision benchmarks of integrator and force backend combinations.
+
+Each combination is run over a range of timesteps on a set of scenarios
+with a known reference solution:
+
+    kepler : two-body orbit, compared with the analytic solution
+    jstaff : the Jstaff triple, compared with a high-precision rk4 run
+    tauris : the Tauris triple, compared with a high-precision rk4 run
+    solar  : the solar system, compared with a high-precision rk4 run
+
+For every run the wall time, number of force evaluations, final position
+error and maximum energy drift are recorded. The results are written to
+<output>_workprecision.csv and, if matplotlib is installed, plotted in
+<output>_<scenario>.png.
+
+The backend "particle" runs the legacy rk4 in grav_nbody_rk4.py. It is
+kept to measure the old interactive simulation, not as a reference: it
+evaluates the last stage at the third stage's position, updates the
+particles one after another, and Particle.acceleration uses distances
+from the particle's current position rather than the stage position.
+Expect much larger errors than the same scheme with the loop backend.
+
+To use:
+
+`python benchmark.py --integrators rk4,leapfrog --timesteps 0.1,1 --output bench`
+
+To compare rk4 with the Wisdom-Holman integrator on the solar system:
+
+`python benchmark.py --scenarios solar --integrators rk4,whfast --timesteps 0.5,2,4`
+"""
+import argparse
+import csv
+import time
+
+import numpy as np
+
+import constants as C
+import integrators
+import systems
+
+COLUMNS = ["scenario", "integrator", "backend", "dt_days", "nsteps",
+           "wall_s", "nforce", "pos_err_rsun", "energy_drift"]
+
+
+def scenarios(duration, eccentricity):
+    """
+    The benchmark scenarios.
+
+    Parameters
+    ----------
+    duration : float
+        The length of the runs compared with a high-precision run.
+        Unit: s
+    eccentricity : float
+        The eccentricity of the two-body orbit.
+
+    Returns
+    -------
+    scenarios : dict
+        Maps the scenario name to (pos, vel, masses, duration, exact), where
+        exact is a function giving the analytic final state, or None.
+    """
+    a, m1, m2 = 200 * C.XRSUN, 1 * C.XMSUN, 0.001 * C.XMSUN
+    kepler_time = 5 * systems.kepler_period(a, m1, m2)
+
+    def kepler_exact():
+        return systems.kepler(a, eccentricity, m1, m2, kepler_time)[:2]
+
+    return {"kepler": systems.kepler(a, eccentricity, m1, m2) + (kepler_time, kepler_exact),
+            "jstaff": systems.jstaff() + (duration, None),
+            "tauris": systems.tauris() + (duration, None),
+            "solar": systems.solar_system() + (duration, None)}
+
+
+def run(integrator, backend, pos, vel, masses, duration, dt, nsample=100):
+    """
+    Integrates a system and measures its cost and energy conservation.
+
+    Parameters
+    ----------
+    integrator : str
+        Name of the integrator in integrators.INTEGRATORS.
+    backend : str
+        Name of the force backend in integrators.BACKENDS, or "particle".
+    pos, vel, masses : numpy.array
+        The initial state of the system.
+    duration : float
+        Unit: s
+    dt : float
+        The requested timestep, rounded so a whole number of steps fit
+        in the duration.
+        Unit: s
+    nsample : int
+        The number of times the energy is checked during the run.
+
+    Returns
+    -------
+    pos, vel : numpy.array
+        The final state of the system.
+    stats : dict
+        The timestep, number of steps, wall time, number of force
+        evaluations and maximum relative energy drift.
+    """
+    if backend == "particle":
+        return run_particles(integrator, pos, vel, masses, duration, dt, nsample)
+
+    nsteps = max(1, int(round(duration / dt)))
+    dt = duration / nsteps
+    step = integrators.INTEGRATORS[integrator]
+    force = integrators.CountedForce(integrators.BACKENDS[backend])
+
+    E0 = integrators.energy(pos, vel, masses)
+    checks = set(np.linspace(0, nsteps, nsample + 1).astype(int)[1:])
+    drift = 0.0
+    wall = 0.0
+
+    for k in range(1, nsteps + 1):
+        start = time.perf_counter()
+        pos, vel = step(pos, vel, masses, dt, force)
+        wall += time.perf_counter() - start
+
+        if k in checks:
+            E = integrators.energy(pos, vel, masses)
+            drift = max(drift, abs((E - E0) / E0))
+
+    return pos, vel, {"dt": dt, "nsteps": nsteps, "wall": wall,
+                      "nforce": force.count, "drift": drift}
+
+
+def run_particles(integrator, pos, vel, masses, duration, dt, nsample=100):
+    """
+    Same as run, but steps Particle objects one at a time with the legacy
+    rk4 in grav_nbody_rk4.py, inconsistencies included.
+    """
+    if integrator != "rk4":
+        raise ValueError("The particle backend only supports rk4")
+
+    # Imported here as it needs pygame
+    import grav_nbody_rk4 as sim
+
+    Plist = [sim.Particle(None, p / C.XRSUN, v / C.XKM, m / C.XMSUN)
+             for p, v, m in zip(pos, vel, masses)]
+
+    nsteps = max(1, int(round(duration / dt)))
+    dt = duration / nsteps
+
+    E0 = integrators.energy(pos, vel, masses)
+    checks = set(np.linspace(0, nsteps, nsample + 1).astype(int)[1:])
+    drift = 0.0
+    wall = 0.0
+
+    for k in range(1, nsteps + 1):
+        start = time.perf_counter()
+        for p in Plist:
+            p.pos, p.vel = sim.rk4(p, Plist, dt)
+        wall += time.perf_counter() - start
+
+        if k in checks:
+            pos = np.array([p.pos for p in Plist])
+            vel = np.array([p.vel for p in Plist])
+            E = integrators.energy(pos, vel, masses)
+            drift = max(drift, abs((E - E0) / E0))
+
+    pos = np.array([p.pos for p in Plist])
+    vel = np.array([p.vel for p in Plist])
+
+    # Four calls to Particle.acceleration per particle per step
+    return pos, vel, {"dt": dt, "nsteps": nsteps, "wall": wall,
+                      "nforce": 4 * nsteps, "drift": drift}
+
+
+def benchmark(names, integrator_names, backend_names, timesteps,
+              duration=C.XYR, eccentricity=0.5, ref_factor=16):
+    """
+    Runs every combination of integrator, backend and timestep.
+
+    Parameters
+    ----------
+    names : [str]
+        The scenarios to run.
+    integrator_names : [str]
+        The integrators to run.
+    backend_names : [str]
+        The force backends to run.
+    timesteps : [float]
+        Unit: s
+    duration : float
+        The length of the runs compared with a high-precision run.
+        Unit: s
+    eccentricity : float
+        The eccentricity of the two-body orbit.
+    ref_factor : int
+        The reference runs use a timestep this many times smaller than
+        the smallest benchmarked timestep.
+
+    Returns
+    -------
+    rows : [dict]
+        One row per run with the keys in COLUMNS.
+    """
+    rows = []
+    all_scenarios = scenarios(duration, eccentricity)
+
+    for name in names:
+        pos0, vel0, masses, length, exact = all_scenarios[name]
+
+        if exact is not None:
+            ref_pos, _ = exact()
+        else:
+            ref_dt = min(timesteps) / ref_factor
+            ref_pos, _, _ = run("rk4", "vectorized", pos0, vel0, masses,
+                                length, ref_dt, nsample=1)
+
+        for integrator in integrator_names:
+            for backend in backend_names:
+                if backend == "particle" and integrator != "rk4":
+                    continue
+
+                for dt in timesteps:
+                    pos, _, stats = run(integrator, backend, pos0, vel0,
+                                        masses, length, dt)
+                    err = np.max(np.linalg.norm(pos - ref_pos, axis=-1))
+
+                    rows.append({"scenario": name,
+                                 "integrator": integrator,
+                                 "backend": backend,
+                                 "dt_days": stats["dt"] / C.XDAY,
+                                 "nsteps": stats["nsteps"],
+                                 "wall_s": stats["wall"],
+                                 "nforce": stats["nforce"],
+                                 "pos_err_rsun": err / C.XRSUN,
+                                 "energy_drift": stats["drift"]})
+
+    return rows
+
+
+def write_table(rows, filename):
+    """
+    Writes the benchmark results to a CSV file.
+    """
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def plot(rows, prefix):
+    """
+    Plots position error against wall time and energy drift against
+    force evaluations, one figure per scenario.
+
+    Does nothing if matplotlib is not installed.
+    """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping plots.")
+        return
+
+    for name in sorted(set(r["scenario"] for r in rows)):
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
+        runs = [r for r in rows if r["scenario"] == name]
+
+        for combo in sorted(set((r["integrator"], r["backend"]) for r in runs)):
+            sel = [r for r in runs if (r["integrator"], r["backend"]) == combo]
+            label = "{0} ({1})".format(*combo)
+            ax1.loglog([r["wall_s"] for r in sel],
+                       [r["pos_err_rsun"] for r in sel], "o-", label=label)
+            ax2.loglog([r["nforce"] for r in sel],
+                       [r["energy_drift"] for r in sel], "o-", label=label)
+
+        ax1.set_xlabel("Wall time (s)")
+        ax1.set_ylabel("Final position error (Rsun)")
+        ax2.set_xlabel("Force evaluations")
+        ax2.set_ylabel("Maximum relative energy drift")
+        ax1.set_title(name)
+        ax1.legend()
+
+        fig.tight_layout()
+        fig.savefig("{0}_{1}.png".format(prefix, name))
+        plt.close(fig)
+
+
+def read_args():
+    """
+    Read the arguments specified by the user.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", help="Comma separated scenarios. \
+                        Default: kepler,jstaff,tauris",
+                        default="kepler,jstaff,tauris")
+    parser.add_argument("--integrators", help="Comma separated integrators. \
+                        Default: all", default=",".join(integrators.INTEGRATORS))
+    parser.add_argument("--backends", help="Comma separated force backends, \
+                        or particle. Default: vectorized", default="vectorized")
+    parser.add_argument("--timesteps", help="Comma separated timesteps. \
+                        Unit: days, Default: 0.1,0.3,1,3", default="0.1,0.3,1,3")
+    parser.add_argument("--duration", help="Length of the runs without \
+                        an analytic solution. \
+                        Unit: years, Default: 1", type=float, default=1)
+    parser.add_argument("--eccentricity", help="Eccentricity of the \
+                        two-body orbit. Default: 0.5", type=float, default=0.5)
+    parser.add_argument("--output", help="Prefix of the output files. \
+                        Default: benchmark", default="benchmark")
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = read_args()
+
+    timesteps = [float(dt) * C.XDAY for dt in args.timesteps.split(",")]
+    rows = benchmark(args.scenarios.split(","), args.integrators.split(","),
+                     args.backends.split(","), timesteps,
+                     args.duration * C.XYR, args.eccentricity)
+
+    write_table(rows, args.output + "_workprecision.csv")
+    plot(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+Camera model used to view the simulation box.
+
+The camera orbits around a target point in the box. It can be rotated,
+zoomed and panned using the mouse and keyboard, and can project either
+orthographically or with perspective.
+
+Controls
+--------
+Left mouse drag      : Orbit the camera around the target
+Right/middle drag    : Pan the view
+Mouse wheel, +/-     : Zoom in and out
+Arrow keys           : Pan the view
+W/A/S/D              : Orbit the camera around the target
+P                    : Toggle between orthographic and perspective
+R                    : Reset the view
+"""
+import pygame as pyg
+
+import numpy as np
+
+import constants as C
+
+
+class Camera:
+    """
+    Class to represent the view into the simulation box.
+
+    With no rotation, no zoom and an orthographic projection, a particle
+    at position (x, y, z) is drawn at pixel (x * SCALE, y * SCALE), which
+    is how the particles were originally drawn.
+
+    Parameters
+    ----------
+    WINSIZE : int
+        The height and width of the window in pixels.
+    SCALE : float
+        The ratio between the WINSIZE and the BOXSIZE.
+        Unit: pixels/Rsun
+    target : [float, float, float]
+        The point the camera looks at, drawn in the centre of the window.
+        Unit: Rsun
+    yaw : float
+        Rotation of the camera about the z axis.
+        Unit: degrees
+    pitch : float
+        Rotation of the camera about its horizontal axis.
+        Unit: degrees
+    perspective : bool
+        Use a perspective projection instead of an orthographic one.
+    fov : float
+        The field of view of the perspective projection.
+        Unit: degrees
+    """
+    ZOOMSTEP = 1.1  # Zoom factor per wheel click or key press
+    ORBITSPEED = 0.5  # Degrees per pixel dragged
+    KEYORBIT = 5.0  # Degrees per key press
+    KEYPAN = 20  # Pixels per key press
+    NEAR = 0.05  # Near clipping plane as a fraction of the camera distance
+
+    def __init__(self, WINSIZE, SCALE, target, yaw=0.0, pitch=0.0,
+                 perspective=False, fov=60.0):
+        self.winsize = WINSIZE
+        self.scale = SCALE
+        self.fov = fov
+        self.init_view = (np.array(target, dtype=float) * C.XRSUN,
+                          yaw, pitch, perspective)
+
+        self.dragging = None  # Mouse button currently dragging the view
+        self.reset()
+
+
+    def __repr__(self):
+        return ('Target:{t} Yaw:{y} Pitch:{p} Zoom:{z} Perspective:{v}'.format(
+                t=self.target / C.XRSUN, y=self.yaw, p=self.pitch,
+                z=self.zoom, v=self.perspective))
+
+
+    def reset(self):
+        """
+        Return the camera to its initial view.
+        """
+        target, yaw, pitch, perspective = self.init_view
+        self.target = target.copy()
+        self.yaw = yaw
+        self.pitch = pitch
+        self.perspective = perspective
+        self.zoom = 1.0
+        self.moved = True
+
+
+    def rotation(self):
+        """
+        Rotation matrix from box coordinates to camera coordinates.
+
+        Returns
+        -------
+        R : numpy.array (3, 3)
+            Rows are the camera right, down and forward axes in
+            box coordinates.
+        """
+        yaw = np.radians(self.yaw)
+        pitch = np.radians(self.pitch)
+
+        Rz = np.array([[np.cos(yaw), -np.sin(yaw), 0],
+                       [np.sin(yaw),  np.cos(yaw), 0],
+                       [0,            0,           1]])
+        Rx = np.array([[1, 0,              0],
+                       [0, np.cos(pitch), -np.sin(pitch)],
+                       [0, np.sin(pitch),  np.cos(pitch)]])
+
+        return Rx @ Rz
+
+
+    def pixel_scale(self):
+        """
+        Pixels per meter in the plane through the target.
+        """
+        return self.scale * self.zoom / C.XRSUN
+
+
+    def distance(self):
+        """
+        Distance from the camera to the target for the perspective view.
+
+        Chosen so that the plane through the target is shown at the same
+        scale as in the orthographic view.
+        """
+        half_width = 0.5 * self.winsize / self.pixel_scale()
+        return half_width / np.tan(0.5 * np.radians(self.fov))
+
+
+    def project(self, positions, radii=None):
+        """
+        Projects an array of positions onto the window.
+
+        Parameters
+        ----------
+        positions : numpy.array (N, 3)
+            The positions to project.
+            Unit: m
+        radii : numpy.array (N,)
+            The radius of each point on the screen before perspective.
+            Unit: pixels
+
+        Returns
+        -------
+        screen : numpy.array (N, 2)
+            The pixel coordinates of each position.
+        scr_rad : numpy.array (N,)
+            The radius on the screen of each position.
+            Unit: pixels
+        depth : numpy.array (N,)
+            Distance in front of the camera, used to sort drawing order.
+            Unit: m
+        visible : numpy.array (N,) bool
+            True for positions that are inside the window.
+        """
+        positions = np.atleast_2d(positions)
+        if radii is None:
+            radii = np.zeros(len(positions))
+
+        view = (positions - self.target) @ self.rotation().T
+        depth = view[:, 2]
+
+        if self.perspective:
+            dist = self.distance()
+            depth = depth + dist
+            in_front = depth > self.NEAR * dist
+            factor = np.where(in_front, dist / np.where(in_front, depth, 1), 0)
+        else:
+            in_front = np.ones(len(view), dtype=bool)
+            factor = np.ones(len(view))
+
+        screen = (view[:, :2] * (self.pixel_scale() * factor)[:, None]
+                  + 0.5 * self.winsize)
+        scr_rad = radii * factor
+
+        # Cull anything that does not overlap the window
+        visible = (in_front
+                   & (screen[:, 0] + scr_rad >= 0)
+                   & (screen[:, 0] - scr_rad <= self.winsize)
+                   & (screen[:, 1] + scr_rad >= 0)
+                   & (screen[:, 1] - scr_rad <= self.winsize))
+
+        return screen, scr_rad, depth, visible
+
+
+    def axis_values(self, pixels):
+        """
+        Physical coordinates along the window edges at the given pixels.
+
+        The values are measured along the camera's horizontal and vertical
+        axes, in the plane through the target.
+
+        Parameters
+        ----------
+        pixels : numpy.array
+            Pixel positions along the edge of the window.
+
+        Returns
+        -------
+        horizontal : numpy.array
+            Coordinates along the top edge of the window.
+            Unit: Rsun
+        vertical : numpy.array
+            Coordinates along the left edge of the window.
+            Unit: Rsun
+        """
+        right, down, _ = self.rotation()
+        offset = (np.asarray(pixels) - 0.5 * self.winsize) / self.pixel_scale()
+
+        horizontal = (np.dot(self.target, right) + offset) / C.XRSUN
+        vertical = (np.dot(self.target, down) + offset) / C.XRSUN
+
+        return horizontal, vertical
+
+
+    def pan(self, dx, dy):
+        """
+        Moves the target by a number of pixels in the window.
+        """
+        right, down, _ = self.rotation()
+        self.target -= (dx * right + dy * down) / self.pixel_scale()
+        self.moved = True
+
+
+    def orbit(self, dyaw, dpitch):
+        """
+        Rotates the camera around the target.
+        """
+        self.yaw = (self.yaw + dyaw) % 360
+        self.pitch = float(np.clip(self.pitch + dpitch, -180, 180))
+        self.moved = True
+
+
+    def zoom_by(self, factor):
+        """
+        Zooms the view in (factor > 1) or out (factor < 1).
+        """
+        self.zoom *= factor
+        self.moved = True
+
+
+    def handle_event(self, event):
+        """
+        Updates the camera from a pygame mouse or keyboard event.
+
+        Parameters
+        ----------
+        event : pygame.event.Event
+            The event to handle.
+
+        Returns
+        -------
+        handled : bool
+            True if the event changed the camera.
+        """
+        if event.type == pyg.MOUSEBUTTONDOWN:
+            if event.button == 4:
+                self.zoom_by(self.ZOOMSTEP)
+            elif event.button == 5:
+                self.zoom_by(1 / self.ZOOMSTEP)
+            elif event.button in (1, 2, 3):
+                self.dragging = event.button
+            return event.button in (4, 5)
+
+        elif event.type == pyg.MOUSEBUTTONUP:
+            if event.button == self.dragging:
+                self.dragging = None
+
+        elif event.type == pyg.MOUSEMOTION and self.dragging:
+            dx, dy = event.rel
+            if self.dragging == 1:
+                self.orbit(dx * self.ORBITSPEED, -dy * self.ORBITSPEED)
+            else:
+                self.pan(dx, dy)
+            return True
+
+        elif event.type == pyg.KEYDOWN:
+            key = event.key
+            if key in (pyg.K_PLUS, pyg.K_EQUALS, pyg.K_KP_PLUS):
+                self.zoom_by(self.ZOOMSTEP)
+            elif key in (pyg.K_MINUS, pyg.K_KP_MINUS):
+                self.zoom_by(1 / self.ZOOMSTEP)
+            elif key == pyg.K_LEFT:
+                self.pan(self.KEYPAN, 0)
+            elif key == pyg.K_RIGHT:
+                self.pan(-self.KEYPAN, 0)
+            elif key == pyg.K_UP:
+                self.pan(0, self.KEYPAN)
+            elif key == pyg.K_DOWN:
+                self.pan(0, -self.KEYPAN)
+            elif key == pyg.K_a:
+                self.orbit(-self.KEYORBIT, 0)
+            elif key == pyg.K_d:
+                self.orbit(self.KEYORBIT, 0)
+            elif key == pyg.K_w:
+                self.orbit(0, self.KEYORBIT)
+            elif key == pyg.K_s:
+                self.orbit(0, -self.KEYORBIT)
+            elif key == pyg.K_p:
+                self.perspective = not self.perspective
+                self.moved = True
+            elif key == pyg.K_r:
+                self.reset()
+            else:
+                return False
+            return True
+
+        return False
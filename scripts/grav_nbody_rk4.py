@@ -7,6 +7,11 @@ import os
 import configparser 
 
 import constants as C
+from camera import Camera
+from trajectory import TrajectoryWriter
+from simulation import Simulation
+from history import History
+import integrators
 
 class Particle:
     """
@@ -45,22 +50,27 @@ class Particle:
                 x=self.pos, v=self.vel, m=self.mas, r=self.rad, c=self.col))
 
 
-    def draw(self, win, SCALE):
+    def draw(self, win, screen_pos, scr_rad):
         """
-        Draws the particle in its initial position.
+        Draws the particle at its projected position.
 
         Parameters
         ----------
         win : pygame.display
             The window to draw the particle
+        screen_pos : (float, float)
+            The pixel coordinates of the particle in the window.
+        scr_rad : float
+            The radius of the particle on the screen.
+            Unit: pixels
 
         Returns
         -------
         NONE
         """
-        pyg.draw.circle(win, self.col, (int(self.pos[0]/C.XRSUN*SCALE), 
-                                        int(self.pos[1]/C.XRSUN*SCALE)), 
-                                        int(self.rad*SCALE) + 2 , 0)
+        pyg.draw.circle(win, self.col, (int(screen_pos[0]), 
+                                        int(screen_pos[1])), 
+                                        max(int(scr_rad), 1), 0)
 
 
     def dist_to(self, other):
@@ -164,24 +174,51 @@ def rk4(particle, particleList, dt):
     return new_pos, new_vel
 
 
-def update_particles(win, Plist, dt, SCALE):
-    for i in range(len(Plist)):
-        Plist[i].pos, Plist[i].vel = rk4(Plist[i], Plist, dt)
-        Plist[i].draw(win, SCALE)
+def draw_particles(win, Plist, positions, camera):
+    """
+    Projects all particles at once and draws the ones in view.
+
+    Particles outside the window are culled before drawing, and the
+    remaining particles are drawn from furthest to nearest.
+
+    Parameters
+    ----------
+    win : pygame.display
+        The window to draw the particles in.
+    Plist : list
+        List of all gravitating particles
+    positions : numpy.array (N, 3)
+        The position of each particle to draw.
+        Unit: m
+    camera : Camera
+        The camera to view the particles with.
+
+    Returns
+    -------
+    NONE
+    """
+    radii = np.array([p.rad * camera.scale + 2 for p in Plist])
+
+    screen, scr_rad, depth, visible = camera.project(positions, radii)
+
+    for i in np.flatnonzero(visible)[np.argsort(-depth[visible])]:
+        Plist[i].draw(win, screen[i], scr_rad[i])
 
 
-def draw_axes(win, WINSIZE, BOXSIZE, TICKNUM, TICKLEN):
+def draw_axes(win, WINSIZE, camera, TICKNUM, TICKLEN):
     """
     Draws the grid lines and labels around the outside of the box.
 
+    The labels show the physical coordinates of the current view.
+
     Parameters
     ----------
     win : pygame.display
         The window to draw the axes in.
     WINSIZE : int
         The height and width of the window to be created.
-    BOXSIZE : int
-        The hight and width of the window in physical units.
+    camera : Camera
+        The camera the window is viewed with.
     TICKNUM : int
         The number of tick marks along each edge of the window.
     TICKLEN : int
@@ -192,7 +229,6 @@ def draw_axes(win, WINSIZE, BOXSIZE, TICKNUM, TICKLEN):
     NONE   
     """
 
-    TICKJUMP = BOXSIZE / TICKNUM  # Value difference between axis labels
     TICKSPACE = WINSIZE / TICKNUM  # Physical distance bwtween axis labels
     TICKCOLOUR = 0x000000  # Black
     TICKTHICK = 2  # THickness of the ticks
@@ -218,17 +254,22 @@ def draw_axes(win, WINSIZE, BOXSIZE, TICKNUM, TICKLEN):
     LABELPAD = 5  # Padding around the ticks for the label
     LABELCOLOUR = (0,0,0)  # Font colour of the labels
 
+    #  Coordinates of the view at each tick
+    ticks = np.arange(1, TICKNUM) * TICKSPACE
+    horizontal, vertical = camera.axis_values(ticks)
+
     for i in range(TICKNUM -1):
         #  Create Labels
-        label = label_font.render(str("{0:.1f}".format(
-                                 (i + 1) * TICKJUMP / C.XRSUN)) + "Rsun", 
-                                 0, LABELCOLOUR)
+        hlabel = label_font.render(str("{0:.1f}".format(horizontal[i])) + "Rsun", 
+                                   0, LABELCOLOUR)
+        vlabel = label_font.render(str("{0:.1f}".format(vertical[i])) + "Rsun", 
+                                   0, LABELCOLOUR)
 
         #  Display Left Ticks
-        win.blit(label, (TICKLEN + LABELPAD, (i+1) * TICKSPACE - label.get_height() / 2.0 ))
+        win.blit(vlabel, (TICKLEN + LABELPAD, (i+1) * TICKSPACE - vlabel.get_height() / 2.0 ))
 
         #  Display Top Ticks
-        win.blit(label, ((i+1) * TICKSPACE - label.get_width() / 2.0, TICKLEN + LABELPAD))
+        win.blit(hlabel, ((i+1) * TICKSPACE - hlabel.get_width() / 2.0, TICKLEN + LABELPAD))
 
 
 def time_display(win, time, WINSIZE, TICKLEN, BACKCOLOUR):
@@ -269,7 +310,7 @@ def time_display(win, time, WINSIZE, TICKLEN, BACKCOLOUR):
                      WINSIZE - TICKLEN - RECT_PAD - timer.get_height()) )
 
 
-def initialise_display(WINSIZE, BOXSIZE, TICKNUM, TICKLEN, time=0):
+def initialise_display(WINSIZE, camera, TICKNUM, TICKLEN, time=0):
     """
     Initialise the window that everything will be displayed in.
 
@@ -280,8 +321,8 @@ def initialise_display(WINSIZE, BOXSIZE, TICKNUM, TICKLEN, time=0):
     ----------
     WINSIZE : int
         The height and width of the window to be created.
-    BOXSIZE : int
-        The hight and width of the window in physical units.
+    camera : Camera
+        The camera the window is viewed with.
     TICKNUM : int
         The number of tick marks along each edge of the window.
     TICKLEN : int
@@ -303,7 +344,7 @@ def initialise_display(WINSIZE, BOXSIZE, TICKNUM, TICKLEN, time=0):
     win.fill(BACKCOLOUR)
     pyg.display.set_caption("3D n-Body Gravitational Simulator")
 
-    draw_axes(win, WINSIZE, BOXSIZE, TICKNUM, TICKLEN)
+    draw_axes(win, WINSIZE, camera, TICKNUM, TICKLEN)
     time_display(win, time, WINSIZE, TICKLEN, BACKCOLOUR)
     pyg.display.flip() 
 
@@ -318,7 +359,8 @@ def read_args():
     user specified. These arguments are used to change the 
     display. The arguments that the user can specify are:
 
-    --winsize, --boxsize, --timestep, --ticknum, --ticklen
+    --winsize, --boxsize, --timestep, --ticknum, --ticklen, --output,
+    --fps, --steps, --integrator, --history
 
     Parameters
     ----------
@@ -336,6 +378,17 @@ def read_args():
         The number of tick marks along each edge of the window.
     TICKLEN : int
         The length of with tick mark in pixels.
+    OUTPUT : str
+        The trajectory file to write each snapshot to, or None.
+    FPS : int
+        The number of frames drawn per second.
+    STEPS : float
+        The number of timesteps taken per frame.
+    INTEGRATOR : str
+        The name of the integrator in integrators.INTEGRATORS.
+    HISTORY : float
+        The memory kept for rewinding, 0 to turn rewinding off.
+        Unit: MB
     """
 
     # Add the arguments for the user
@@ -352,6 +405,18 @@ def read_args():
                          of the window. Default: 10", type=int)
     parser.add_argument("--ticklen", help="The length of each tick on the \
                          side of the window in pixels. Default: 20", type=int)
+    parser.add_argument("--output", help="Write every snapshot to this \
+                         binary trajectory file. Default: None")
+    parser.add_argument("--fps", help="The number of frames drawn per \
+                         second. Default: 60", type=int)
+    parser.add_argument("--steps", help="The number of timesteps taken per \
+                         frame. Default: 1", type=float)
+    parser.add_argument("--integrator", help="The integrator to use, one of \
+                         " + ", ".join(integrators.INTEGRATORS) + ". \
+                         Default: rk4", choices=integrators.INTEGRATORS)
+    parser.add_argument("--history", help="The memory kept for rewinding \
+                         the simulation, 0 to turn it off. \
+                         Unit: MB, Default: 64", type=float)
 
     args = parser.parse_args()
 
@@ -389,7 +454,89 @@ def read_args():
     else:
         TICKLEN = 20   
 
-    return WINSIZE, BOXSIZE, SCALE, TIMESTEP, TICKNUM, TICKLEN
+    OUTPUT = args.output
+
+    if args.fps:
+        FPS = args.fps
+    else:
+        FPS = 60
+
+    if args.steps:
+        STEPS = args.steps
+    else:
+        STEPS = 1
+
+    if args.integrator:
+        INTEGRATOR = args.integrator
+    else:
+        INTEGRATOR = "rk4"
+
+    if args.history is not None:
+        HISTORY = args.history
+    else:
+        HISTORY = 64
+
+    return (WINSIZE, BOXSIZE, SCALE, TIMESTEP, TICKNUM, TICKLEN, OUTPUT,
+            FPS, STEPS, INTEGRATOR, HISTORY)
+
+SCRUBJUMP = 100  # Frames moved by PAGE UP and PAGE DOWN
+
+
+def handle_sim_event(sim, event):
+    """
+    Changes the speed of the simulation from a pygame keyboard event.
+
+    SPACE pauses and resumes, and [ and ] halve and double the simulation
+    time per second. The history is scrubbed one frame at a time with
+    , and . (stepping on past its end), a segment at a time with PAGE UP
+    and PAGE DOWN, and HOME and END jump to its start and end.
+
+    Parameters
+    ----------
+    sim : Simulation
+        The running simulation.
+    event : pygame.event.Event
+        The event to handle.
+
+    Returns
+    -------
+    handled : bool
+        True if the event changed the simulation.
+    """
+    if event.type != pyg.KEYDOWN:
+        return False
+
+    if event.key == pyg.K_SPACE:
+        sim.toggle_pause()
+    elif event.key == pyg.K_PERIOD:
+        sim.scrub(1)
+    elif event.key == pyg.K_COMMA:
+        sim.scrub(-1)
+    elif event.key == pyg.K_PAGEUP:
+        sim.scrub(-SCRUBJUMP)
+    elif event.key == pyg.K_PAGEDOWN:
+        sim.scrub(SCRUBJUMP)
+    elif event.key == pyg.K_HOME:
+        sim.seek(-np.inf)
+    elif event.key == pyg.K_END:
+        sim.seek(np.inf)
+    elif event.key == pyg.K_LEFTBRACKET:
+        sim.set_rate(sim.rate / 2)
+    elif event.key == pyg.K_RIGHTBRACKET:
+        sim.set_rate(sim.rate * 2)
+    else:
+        return False
+
+    show_rate(sim)
+    return True
+
+
+def show_rate(sim):
+    """
+    Shows the simulation time per second in the window title.
+    """
+    status = "paused" if sim.paused else "{0:.3g} days/s".format(sim.rate / C.XDAY)
+    pyg.display.set_caption("3D n-Body Gravitational Simulator ({0})".format(status))
 
 ### WORK IN PROGRESS
 # def read_param_file(win, file):
@@ -421,11 +568,15 @@ def read_args():
 # #                print(pList[i])
 def main():
 
-    WINSIZE, BOXSIZE, SCALE, TIMESTEP, TICKNUM, TICKLEN = read_args()
+    (WINSIZE, BOXSIZE, SCALE, TIMESTEP, TICKNUM, TICKLEN, OUTPUT,
+     FPS, STEPS, INTEGRATOR, HISTORY) = read_args()
+
 
 
+    # Look at the centre of the box
+    camera = Camera(WINSIZE, SCALE, [BOXSIZE/(2*C.XRSUN)] * 2 + [0])
 
-    win, BACKCOLOUR = initialise_display(WINSIZE, BOXSIZE, TICKNUM, TICKLEN)
+    win, BACKCOLOUR = initialise_display(WINSIZE, camera, TICKNUM, TICKLEN)
 
     #particle_list = read_param_file(win, param) 
 
@@ -451,20 +602,56 @@ def main():
              Particle(win, [BOXSIZE/(2*C.XRSUN) + 338.000000000000, BOXSIZE/(2*C.XRSUN), 0], [0,   -20.8,    0], 0.0095, 5,(0,0,255))]
 
 
-    time = 0
+    # Save the trajectory for later analysis
+    writer = None
+    if OUTPUT:
+        writer = TrajectoryWriter(OUTPUT, [p.mas for p in Plist])
+        writer.write_particles(0, Plist)
+
+    # Keep recent states for rewinding
+    history = None
+    if HISTORY > 0:
+        history = History(int(HISTORY * 2**20))
+
+    # Run the physics in its own thread at STEPS timesteps per frame
+    sim = Simulation([p.pos for p in Plist], [p.vel for p in Plist],
+                     [p.mas for p in Plist], TIMESTEP,
+                     integrators.INTEGRATORS[INTEGRATOR],
+                     integrators.accel_vectorized,
+                     STEPS * TIMESTEP * FPS, writer, history)
+    sim.start()
+    show_rate(sim)
+
+    clock = pyg.time.Clock()
+    last_time = 0
     running = True
     while running:
+        time, positions, _ = sim.latest()
+
+        # Clear the old tracks when the view changes or the simulation
+        # is rewound, as the tracks ahead of it no longer happened
+        if camera.moved or time < last_time:
+            win.fill(BACKCOLOUR)
+            camera.moved = False
+        last_time = time
+
+        draw_particles(win, Plist, positions, camera)
+        time_display(win, time / C.XYR, WINSIZE, TICKLEN, BACKCOLOUR)
+        draw_axes(win, WINSIZE, camera, TICKNUM, TICKLEN)
         pyg.display.flip()  # Refresh Display
-        time += TIMESTEP / C.XYR
-
-        update_particles(win, Plist, TIMESTEP, SCALE)
-        time_display(win, time, WINSIZE, TICKLEN, BACKCOLOUR)
-        draw_axes(win, WINSIZE, BOXSIZE, TICKNUM, TICKLEN)
 
         # Check of the close button is pushed and Quit if so.
         for event in pyg.event.get():
             if event.type == pyg.QUIT:
                 running = False
+            elif not handle_sim_event(sim, event):
+                camera.handle_event(event)
+
+        clock.tick(FPS)  # Wait until the next frame is due
+
+    sim.stop()
+    if writer:
+        writer.close()
 
 if __name__ == '__main__':
     main()
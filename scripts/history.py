@@ -0,0 +1,378 @@
+"""
+Compressed in-memory history of a simulation, for rewinding and scrubbing.
+
+The history is a list of segments. Each segment starts with a full
+keyframe of the state (float64) followed by the changes from one step to
+the next, stored as float32 deltas. Once a segment is full its deltas are
+compressed with lz4, if it is installed, or zlib.
+
+The deltas are taken from the previously reconstructed state rather than
+the previous true state, so the float32 rounding does not build up along
+a segment.
+
+When the history grows past its memory budget, the least recently used
+segments are thinned by dropping their deltas, keeping only their
+keyframes. The thinned keyframes may use at most a fixed share of the
+budget; past that, the oldest of them are dropped instead, so the budget
+is mostly spent on dense recent frames. A seek returns the latest stored
+frame at or before the requested time, and the caller replays the
+integration from there to reach the exact time.
+"""
+import heapq
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+
+def _compress(data):
+    if lz4 is not None:
+        return lz4.compress(data)
+    return zlib.compress(data, 1)
+
+
+def _decompress(data):
+    if lz4 is not None:
+        return lz4.decompress(data)
+    return zlib.decompress(data)
+
+
+class _Segment:
+    """
+    A keyframe and the deltas of the frames that follow it.
+    """
+    OVERHEAD = 256  # Rough bytes used by the segment object itself
+
+    def __init__(self, time, pos, vel):
+        self.key_pos = np.array(pos, dtype=np.float64)
+        self.key_vel = np.array(vel, dtype=np.float64)
+        self.times = [time]
+        self.deltas = []  # float32 (2, N, 3) per frame while the segment is open
+        self.blob = None  # Compressed deltas once the segment is closed
+        self.thinned = False
+        self.dropped = False
+        self.last_used = 0
+
+    @property
+    def start(self):
+        return self.times[0]
+
+    @property
+    def end(self):
+        return self.times[-1] if not self.thinned else self.times[0]
+
+    def nbytes(self):
+        size = self.OVERHEAD + self.key_pos.nbytes + self.key_vel.nbytes
+        size += 8 * len(self.times)
+        size += sum(d.nbytes for d in self.deltas)
+        if self.blob is not None:
+            size += len(self.blob)
+        return size
+
+    def close(self):
+        """
+        Compresses the deltas of a full segment.
+        """
+        if self.deltas:
+            self.blob = _compress(np.stack(self.deltas).tobytes())
+        self.deltas = []
+
+    def thin(self):
+        """
+        Drops every frame but the keyframe.
+        """
+        self.deltas = []
+        self.blob = None
+        self.times = self.times[:1]
+        self.thinned = True
+
+    def raw_deltas(self):
+        """
+        The float32 deltas, shape (nframes - 1, 2, N, 3).
+        """
+        shape = (len(self.times) - 1, 2) + self.key_pos.shape
+        if self.blob is not None:
+            data = np.frombuffer(_decompress(self.blob), dtype=np.float32)
+            return data.reshape(shape)
+        if self.deltas:
+            return np.stack(self.deltas)
+        return np.zeros(shape, dtype=np.float32)
+
+    def decode(self):
+        """
+        Reconstructs every frame of the segment.
+
+        Returns
+        -------
+        times : numpy.array (n,)
+        pos, vel : numpy.array (n, N, 3)
+        """
+        deltas = self.raw_deltas().astype(np.float64)
+        key = np.stack([self.key_pos, self.key_vel])
+        states = np.concatenate([key[None], deltas])
+
+        # Same sums, in the same order, as History.record
+        for i in range(1, len(states)):
+            states[i] += states[i - 1]
+
+        return np.array(self.times), states[:, 0], states[:, 1]
+
+
+class History:
+    """
+    Class to store the recent states of a simulation in a memory budget.
+
+    Parameters
+    ----------
+    budget : int
+        The most memory the history may use.
+        Unit: bytes
+    keyframe_every : int
+        The number of frames in each segment, including its keyframe.
+    """
+    KEYFRAME_SHARE = 0.25  # Most of the budget used by thinned keyframes
+
+    def __init__(self, budget=64 * 2**20, keyframe_every=256):
+        self.budget = budget
+        self.keyframe_every = keyframe_every
+        self.segments = []
+        self.recon = None  # Reconstructed (pos, vel) of the last frame
+        self.clock = 0  # Counter used to find the least recently used segment
+        self.lru = []  # Heap of (last_used, segment) for closed full segments
+        self.cache = (None, None)  # Last decoded segment, for scrubbing
+        self.nbytes = 0
+        self.key_bytes = 0  # Bytes used by thinned segments
+
+
+    def __len__(self):
+        return sum(len(s.times) for s in self.segments)
+
+
+    def __repr__(self):
+        return ('Frames:{n} Segments:{s} Bytes:{b} Budget:{B}'.format(
+                n=len(self), s=len(self.segments), b=self.nbytes, B=self.budget))
+
+
+    @property
+    def start_time(self):
+        return self.segments[0].start if self.segments else None
+
+
+    @property
+    def end_time(self):
+        return self.segments[-1].end if self.segments else None
+
+
+    def _touch(self, segment):
+        self.clock += 1
+        segment.last_used = self.clock
+
+        # The open segment is queued for eviction when it is closed
+        if segment.blob is not None:
+            heapq.heappush(self.lru, (segment.last_used, segment))
+
+
+    def record(self, time, pos, vel):
+        """
+        Adds the state after a step to the end of the history.
+
+        Parameters
+        ----------
+        time : float
+            Unit: s
+        pos : numpy.array (N, 3)
+            Unit: m
+        vel : numpy.array (N, 3)
+            Unit: m/s
+        """
+        last = self.segments[-1] if self.segments else None
+
+        if (last is None or last.thinned or self.recon is None
+                or len(last.times) >= self.keyframe_every):
+            if last is not None and not last.thinned:
+                self.nbytes -= last.nbytes()
+                last.close()
+                self.nbytes += last.nbytes()
+                heapq.heappush(self.lru, (last.last_used, last))
+
+            last = _Segment(time, pos, vel)
+            self.segments.append(last)
+            self.recon = np.stack([last.key_pos, last.key_vel])
+        else:
+            state = np.stack([pos, vel])
+            delta = (state - self.recon).astype(np.float32)
+            self.recon += delta.astype(np.float64)
+
+            self.nbytes -= last.nbytes()
+            last.times.append(time)
+            last.deltas.append(delta)
+
+        self.nbytes += last.nbytes()
+        self._touch(last)
+
+        if self.nbytes > self.budget:
+            self._evict()
+
+
+    def _evict(self):
+        """
+        Frees memory until the history fits in its budget.
+
+        Thins the least recently used segment, unless the thinned keyframes
+        are over their share of the budget, in which case the oldest one is
+        dropped. The open segment is never evicted.
+        """
+        while self.nbytes > self.budget and len(self.segments) > 1:
+            if self.key_bytes > self.KEYFRAME_SHARE * self.budget:
+                if not self._drop_oldest():
+                    self._thin_lru()
+            elif not self._thin_lru():
+                if not self._drop_oldest():
+                    break
+
+
+    def _forget(self, segment):
+        if self.cache[0] is not None and self.cache[0][0] is segment:
+            self.cache = (None, None)
+
+
+    def _thin_lru(self):
+        """
+        Thins the least recently used closed segment.
+
+        Returns
+        -------
+        thinned : bool
+            False if there was no segment to thin.
+        """
+        while self.lru:
+            last_used, segment = heapq.heappop(self.lru)
+
+            # Skip entries made stale by a later use, thinning or truncation
+            if (segment.thinned or segment.dropped or segment.blob is None
+                    or segment.last_used != last_used):
+                continue
+
+            self.nbytes -= segment.nbytes()
+            segment.thin()
+            self.nbytes += segment.nbytes()
+            self.key_bytes += segment.nbytes()
+            self._forget(segment)
+            return True
+
+        return False
+
+
+    def _drop_oldest(self):
+        """
+        Drops the oldest thinned keyframe.
+
+        Returns
+        -------
+        dropped : bool
+            False if there was no thinned keyframe to drop.
+        """
+        # Old segments are thinned first, so this is usually the first one
+        for i in range(len(self.segments) - 1):
+            segment = self.segments[i]
+            if segment.thinned:
+                del self.segments[i]
+                segment.dropped = True
+                self.nbytes -= segment.nbytes()
+                self.key_bytes -= segment.nbytes()
+                self._forget(segment)
+                return True
+
+        return False
+
+
+    def _frames(self, segment):
+        # The open segment can grow between seeks, so check its length too
+        key = (segment, len(segment.times))
+        if self.cache[0] != key:
+            self.cache = (key, segment.decode())
+        self._touch(segment)
+        return self.cache[1]
+
+
+    def _find(self, time):
+        """
+        Index of the last segment starting at or before time.
+        """
+        starts = [s.start for s in self.segments]
+        return max(int(np.searchsorted(starts, time, side="right")) - 1, 0)
+
+
+    def seek(self, time):
+        """
+        The latest stored frame at or before a time.
+
+        If the time is before the start of the history, the first frame
+        is returned instead.
+
+        Parameters
+        ----------
+        time : float
+            Unit: s
+
+        Returns
+        -------
+        time : float
+            The time of the returned frame.
+            Unit: s
+        pos, vel : numpy.array (N, 3)
+            The stored state, or None if the history is empty.
+        """
+        if not self.segments:
+            return None
+
+        segment = self.segments[self._find(time)]
+        times, pos, vel = self._frames(segment)
+        i = max(int(np.searchsorted(times, time, side="right")) - 1, 0)
+
+        return times[i], pos[i].copy(), vel[i].copy()
+
+
+    def truncate(self, time):
+        """
+        Forgets every frame after a time, so that recording can continue
+        from there after a rewind.
+
+        Parameters
+        ----------
+        time : float
+            Unit: s
+        """
+        while self.segments and self.segments[-1].start > time:
+            segment = self.segments.pop()
+            segment.dropped = True
+            self.nbytes -= segment.nbytes()
+            if segment.thinned:
+                self.key_bytes -= segment.nbytes()
+
+        self.cache = (None, None)
+        if not self.segments:
+            self.recon = None
+            return
+
+        segment = self.segments[-1]
+        keep = int(np.searchsorted(segment.times, time, side="right"))
+        if segment.thinned:
+            # Start a new segment at the next recorded frame
+            self.recon = None
+            return
+
+        self.nbytes -= segment.nbytes()
+        deltas = segment.raw_deltas()[:keep - 1]
+        segment.times = segment.times[:keep]
+        segment.deltas = list(deltas.copy())
+        segment.blob = None
+        self.nbytes += segment.nbytes()
+
+        # Continue the reconstruction from the last kept frame
+        _, pos, vel = segment.decode()
+        self.recon = np.stack([pos[-1], vel[-1]])
@@ -0,0 +1,171 @@
+"""
+Array based force backends and integrators.
+
+The state of a simulation is held in arrays rather than Particle objects:
+
+    pos    : numpy.array (N, 3)   Unit: m
+    vel    : numpy.array (N, 3)   Unit: m/s
+    masses : numpy.array (N,)     Unit: kg
+
+A force backend has the signature accel(pos, masses) and returns the
+gravitational acceleration of every particle. An integrator has the
+signature step(pos, vel, masses, dt, accel) and returns the new pos and vel
+after a timestep dt, updating every particle simultaneously.
+
+The Wisdom-Holman integrator for systems with a dominant central body is
+in whfast.py.
+"""
+import numpy as np
+
+import constants as C
+import whfast
+
+
+def accel_loop(pos, masses):
+    """
+    Acceleration of every particle, summing pairs in a python loop.
+
+    Each pair distance is taken between the positions passed in. This
+    differs from Particle.acceleration, which uses the distance from the
+    particle's current position whatever position it is asked about.
+
+    Parameters
+    ----------
+    pos : numpy.array (N, 3)
+        The positions of the particles.
+        Unit: m
+    masses : numpy.array (N,)
+        The masses of the particles.
+        Unit: kg
+
+    Returns
+    -------
+    a : numpy.array (N, 3)
+        The acceleration of each particle.
+        Unit: m/s^2
+    """
+    N = len(masses)
+    a = np.zeros((N, 3))
+    for i in range(N):
+        for j in range(N):
+            if i != j:
+                delta = pos[j] - pos[i]
+                dist = np.linalg.norm(delta)
+                a[i] += C.XG * masses[j] * delta / dist**3
+
+    return a
+
+
+def accel_vectorized(pos, masses):
+    """
+    Acceleration of every particle, summing all pairs with broadcasting.
+
+    Parameters
+    ----------
+    pos : numpy.array (N, 3)
+        The positions of the particles.
+        Unit: m
+    masses : numpy.array (N,)
+        The masses of the particles.
+        Unit: kg
+
+    Returns
+    -------
+    a : numpy.array (N, 3)
+        The acceleration of each particle.
+        Unit: m/s^2
+    """
+    delta = pos[None, :, :] - pos[:, None, :]
+    dist2 = np.sum(delta**2, axis=-1)
+    np.fill_diagonal(dist2, np.inf)  # No self gravity
+
+    return C.XG * np.einsum("ij,ijk->ik", masses[None, :] / dist2**1.5, delta)
+
+
+class CountedForce:
+    """
+    Wraps a force backend and counts how many times it is evaluated.
+
+    Parameters
+    ----------
+    accel : function
+        The force backend to wrap.
+    """
+    def __init__(self, accel):
+        self.accel = accel
+        self.count = 0
+
+
+    def __call__(self, pos, masses):
+        self.count += 1
+        return self.accel(pos, masses)
+
+
+def euler(pos, vel, masses, dt, accel):
+    """
+    Semi-implicit (symplectic) Euler step. One force evaluation.
+    """
+    vel = vel + dt * accel(pos, masses)
+    pos = pos + dt * vel
+
+    return pos, vel
+
+
+def leapfrog(pos, vel, masses, dt, accel):
+    """
+    Kick-drift-kick leapfrog step. Two force evaluations.
+    """
+    vel = vel + 0.5 * dt * accel(pos, masses)
+    pos = pos + dt * vel
+    vel = vel + 0.5 * dt * accel(pos, masses)
+
+    return pos, vel
+
+
+def rk4(pos, vel, masses, dt, accel):
+    """
+    Classical fourth order Runge-Kutta step. Four force evaluations.
+    """
+    kp1 = vel
+    kv1 = accel(pos, masses)
+
+    kp2 = vel + 0.5 * dt * kv1
+    kv2 = accel(pos + 0.5 * dt * kp1, masses)
+
+    kp3 = vel + 0.5 * dt * kv2
+    kv3 = accel(pos + 0.5 * dt * kp2, masses)
+
+    kp4 = vel + dt * kv3
+    kv4 = accel(pos + dt * kp3, masses)
+
+    new_pos = pos + (dt / 6.) * (kp1 + 2 * (kp2 + kp3) + kp4)
+    new_vel = vel + (dt / 6.) * (kv1 + 2 * (kv2 + kv3) + kv4)
+
+    return new_pos, new_vel
+
+
+def energy(pos, vel, masses):
+    """
+    Total kinetic plus potential energy of the system.
+
+    Returns
+    -------
+    E : float
+        Unit: J
+    """
+    kinetic = 0.5 * np.sum(masses * np.sum(vel**2, axis=-1))
+
+    i, j = np.triu_indices(len(masses), k=1)
+    dist = np.linalg.norm(pos[i] - pos[j], axis=-1)
+    potential = -C.XG * np.sum(masses[i] * masses[j] / dist)
+
+    return kinetic + potential
+
+
+INTEGRATORS = {"euler": euler,
+               "leapfrog": leapfrog,
+               "rk4": rk4,
+               "whfast": whfast.step}
+
+BACKENDS = {"loop": accel_loop,
+            "vectorized": accel_vectorized}
@@ -0,0 +1,255 @@
+"""
+Runs the physics in a worker thread, separate from the display.
+
+The worker integrates its own copy of the state and publishes a snapshot
+after every batch of steps. The display only ever reads the latest
+published snapshot, so drawing a frame never waits on the integration
+and the integration is not limited to one step per frame.
+
+The speed of the simulation is set as a rate of simulation seconds per
+wall clock second. The worker takes as many steps as needed to keep up
+with that rate and sleeps when it is ahead.
+
+If given a History, every step is recorded so the simulation can be
+paused, rewound and scrubbed. Stepping on from a rewound state forgets
+the old future and records the new one, in both the history and the
+trajectory file.
+"""
+import threading
+import time
+
+import numpy as np
+
+
+class Simulation(threading.Thread):
+    """
+    Class to integrate a system in a background thread.
+
+    Parameters
+    ----------
+    pos : numpy.array (N, 3)
+        The initial positions.
+        Unit: m
+    vel : numpy.array (N, 3)
+        The initial velocities.
+        Unit: m/s
+    masses : numpy.array (N,)
+        Unit: kg
+    dt : float
+        The timestep.
+        Unit: s
+    step : function
+        An integrator from integrators.py.
+    accel : function
+        A force backend from integrators.py.
+    rate : float
+        Simulation seconds per wall clock second.
+    writer : TrajectoryWriter
+        Optional writer that every step is saved with.
+    history : History
+        Optional history that every step is recorded in for rewinding.
+    """
+    MAXSTEPS = 10000  # Most steps the worker may fall behind by
+    PUBLISH = 0.01  # Longest time spent stepping between snapshots (s)
+    IDLE = 0.005  # Longest sleep when ahead of the rate (s)
+
+    def __init__(self, pos, vel, masses, dt, step, accel, rate, writer=None,
+                 history=None):
+        super().__init__(daemon=True)
+        self.pos = np.array(pos, dtype=float)
+        self.vel = np.array(vel, dtype=float)
+        self.masses = np.array(masses, dtype=float)
+        self.dt = dt
+        self.step = step
+        self.accel = accel
+        self.writer = writer
+        self.history = history
+
+        self.time = 0.0
+        self.rate = rate
+        self.paused = False
+        self.pending = 0  # Single steps requested while paused
+        self.budget = 0.0  # Simulation time owed to keep up with the rate
+        self.scrub_frames = 0  # Frames to move through the history
+        self.seek_time = None  # Time to jump to in the history
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.halt = threading.Event()
+        self.snapshot = (self.time, self.pos, self.vel)
+
+        if self.history is not None:
+            self.history.record(self.time, self.pos, self.vel)
+
+
+    def latest(self):
+        """
+        The most recently published state.
+
+        Returns
+        -------
+        time : float
+            Unit: s
+        pos : numpy.array (N, 3)
+            Unit: m
+        vel : numpy.array (N, 3)
+            Unit: m/s
+        """
+        with self.lock:
+            return self.snapshot
+
+
+    def set_rate(self, rate):
+        """
+        Sets the simulation seconds per wall clock second.
+        """
+        with self.lock:
+            self.rate = rate
+        self.wake.set()
+
+
+    def toggle_pause(self):
+        with self.lock:
+            self.paused = not self.paused
+            self.budget = 0.0
+        self.wake.set()
+
+
+    def scrub(self, n=1):
+        """
+        Pauses and moves n frames forward or backward through the history.
+
+        Moving forward past the end of the history takes new steps.
+        """
+        with self.lock:
+            self.paused = True
+            self.budget = 0.0
+            self.scrub_frames += n
+        self.wake.set()
+
+
+    def seek(self, time):
+        """
+        Pauses and jumps to a time in the history.
+
+        The time is clamped to the start of the history, and to its end
+        if infinite. Jumping to a finite time after the end takes new steps.
+        """
+        with self.lock:
+            self.paused = True
+            self.budget = 0.0
+            self.scrub_frames = 0
+            self.seek_time = time
+        self.wake.set()
+
+
+    def stop(self):
+        """
+        Stops the thread and waits for it to finish.
+        """
+        self.halt.set()
+        self.wake.set()
+        self.join()
+
+
+    def run(self):
+        last = time.perf_counter()
+
+        while not self.halt.is_set():
+            now = time.perf_counter()
+            with self.lock:
+                if not self.paused:
+                    self.budget += (now - last) * self.rate
+                nsteps = int(self.budget // self.dt) + self.pending
+                self.pending = 0
+                rate = self.rate
+                scrub, self.scrub_frames = self.scrub_frames, 0
+                seek_time, self.seek_time = self.seek_time, None
+            last = now
+
+            if seek_time is not None or scrub:
+                if seek_time is None:
+                    seek_time = self.time + scrub * self.dt
+                self._seek(seek_time)
+                continue
+
+            if nsteps == 0:
+                # Ahead of the rate, sleep until the next step is due
+                wait = self.IDLE if rate <= 0 else min(self.dt / rate, self.IDLE)
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+
+            # Fall behind rather than stall the display if the rate is too high
+            nsteps = min(nsteps, self.MAXSTEPS)
+
+            # Stepping on from a rewound state replaces the old future
+            history = self.history
+            if history is not None and self.time < history.end_time - 0.5 * self.dt:
+                history.truncate(self.time)
+                if self.writer:
+                    self.writer.truncate(self.time)
+
+            pos, vel = self.pos, self.vel
+            taken = 0
+            while taken < nsteps and time.perf_counter() - now < self.PUBLISH:
+                pos, vel = self.step(pos, vel, self.masses, self.dt, self.accel)
+                self.time += self.dt
+                taken += 1
+                if self.writer:
+                    self.writer.write(self.time, pos, vel)
+                if history is not None:
+                    history.record(self.time, pos, vel)
+            self.pos, self.vel = pos, vel
+
+            # Integrators return new arrays, so the published snapshot is
+            # never modified by later steps
+            with self.lock:
+                self.budget = min(max(self.budget - taken * self.dt, 0.0),
+                                  self.MAXSTEPS * self.dt)
+                self.snapshot = (self.time, pos, vel)
+
+
+    def _seek(self, target):
+        """
+        Moves the state to a time in the history and publishes it.
+
+        Starts from the latest stored frame at or before the target, and
+        replays the integration from there if the frames in between were
+        thinned out of the history. The whole gap is replayed, so a seek
+        across dropped segments always lands on the target, and snapshots
+        are published along the way so the display shows the progress.
+        """
+        extra = 0
+        if self.history is None or self.history.end_time is None:
+            # Without a history the only way to move is forward, by stepping
+            if np.isfinite(target):
+                extra = max(int(round((target - self.time) / self.dt)), 0)
+        else:
+            end = self.history.end_time
+            if target > end:
+                if np.isfinite(target):
+                    extra = int(round((target - end) / self.dt))
+                target = end
+            target = max(target, self.history.start_time)
+
+            t, pos, vel = self.history.seek(target + 0.5 * self.dt)
+
+            # Replay the whole gap, however long, publishing as it goes
+            replay = max(int(round((target - t) / self.dt)), 0)
+            start = time.perf_counter()
+            for _ in range(replay):
+                if self.halt.is_set():
+                    break
+                pos, vel = self.step(pos, vel, self.masses, self.dt, self.accel)
+                t += self.dt
+                if time.perf_counter() - start > self.PUBLISH:
+                    with self.lock:
+                        self.snapshot = (t, pos, vel)
+                    start = time.perf_counter()
+
+            self.time, self.pos, self.vel = t, pos, vel
+
+        with self.lock:
+            self.pending += extra
+            self.snapshot = (self.time, self.pos, self.vel)
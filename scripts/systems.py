@@ -0,0 +1,130 @@
+"""
+Initial conditions of the bundled simulations.
+
+Each function returns the state of a system as arrays in SI units:
+
+    pos    : numpy.array (N, 3)   Unit: m
+    vel    : numpy.array (N, 3)   Unit: m/s
+    masses : numpy.array (N,)     Unit: kg
+
+The triples and the solar system are the ones set up in main() of
+grav_nbody_rk4.py.
+"""
+import numpy as np
+
+import constants as C
+
+
+def _state(x, vy, mass):
+    """
+    State of bodies on the x axis moving along y.
+
+    Parameters
+    ----------
+    x : [float]
+        Unit: Rsun
+    vy : [float]
+        Unit: km/s
+    mass : [float]
+        Unit: Msun
+    """
+    N = len(x)
+    pos = np.zeros((N, 3))
+    vel = np.zeros((N, 3))
+    pos[:, 0] = np.array(x, dtype=float) * C.XRSUN
+    vel[:, 1] = np.array(vy, dtype=float) * C.XKM
+
+    return pos, vel, np.array(mass, dtype=float) * C.XMSUN
+
+
+def jstaff():
+    """
+    The Jstaff triple: a 0.77 Msun star with two 0.0095 Msun companions.
+    """
+    return _state([0, 186, 338], [0.346, -20.8, -20.8], [0.77, 0.0095, 0.0095])
+
+
+def tauris():
+    """
+    The Tauris triple: 9.9, 1.1 and 1.3 Msun stars.
+    """
+    return _state([0, 478.6558908050, 1998.563218391],
+                  [6.623627965, -59.556125654, -27.561533740],
+                  [9.9, 1.1, 1.3])
+
+
+def solar_system():
+    """
+    The Sun and the eight planets, starting in a line along the x axis.
+    """
+    return _state([0, 66.120, 154.50, 211.40, 297.00,
+                   1064.4, 1944.2, 3940.3, 6388.5],
+                  [0, -58.98, -35.26, -30.29, -26.50,
+                   -13.72, -10.18, -7.110, -5.500],
+                  [1, 0.000000165, 0.000002447, 0.000003003, 0.000000321,
+                   0.0009543, 0.0002857, 0.00004364, 0.00005149])
+
+
+def kepler_period(a, m1, m2):
+    """
+    Period of a two-body orbit.
+
+    Parameters
+    ----------
+    a : float
+        Semi-major axis. Unit: m
+    m1, m2 : float
+        Masses of the bodies. Unit: kg
+
+    Returns
+    -------
+    period : float
+        Unit: s
+    """
+    return 2 * np.pi * np.sqrt(a**3 / (C.XG * (m1 + m2)))
+
+
+def kepler(a, e, m1, m2, t=0.0):
+    """
+    Analytic two-body orbit in the x-y plane.
+
+    The bodies start at periapsis on the x axis at t = 0, with the centre
+    of mass at rest at the origin.
+
+    Parameters
+    ----------
+    a : float
+        Semi-major axis of the relative orbit. Unit: m
+    e : float
+        Eccentricity, 0 <= e < 1.
+    m1, m2 : float
+        Masses of the bodies. Unit: kg
+    t : float
+        The time to find the state at. Unit: s
+
+    Returns
+    -------
+    pos, vel, masses
+        The state of the two bodies at time t.
+    """
+    M = m1 + m2
+    mu = C.XG * M
+    n = np.sqrt(mu / a**3)
+
+    # Solve Kepler's equation E - e sin(E) = n t with Newton's method
+    mean_anom = np.mod(n * t, 2 * np.pi)
+    E = mean_anom if e < 0.8 else np.pi
+    for _ in range(50):
+        dE = (E - e * np.sin(E) - mean_anom) / (1 - e * np.cos(E))
+        E -= dE
+        if abs(dE) < 1e-15:
+            break
+
+    r = a * (1 - e * np.cos(E))
+    rel_pos = np.array([a * (np.cos(E) - e), a * np.sqrt(1 - e**2) * np.sin(E), 0])
+    rel_vel = np.sqrt(mu * a) / r * np.array([-np.sin(E), np.sqrt(1 - e**2) * np.cos(E), 0])
+
+    pos = np.array([-m2 / M * rel_pos, m1 / M * rel_pos])
+    vel = np.array([-m2 / M * rel_vel, m1 / M * rel_vel])
+
+    return pos, vel, np.array([m1, m2], dtype=float)
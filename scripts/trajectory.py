@@ -0,0 +1,219 @@
+"""
+Reading and writing binary trajectory files.
+
+A trajectory file starts with a header holding the number of particles
+and their masses, followed by one fixed size record per snapshot:
+
+    header : magic (8 bytes), N (int64), masses (N float64, kg)
+    record : time (float64, s), pos (N x 3 float64, m), vel (N x 3 float64, m/s)
+
+All values are stored little endian in SI units so that a file can be
+memory mapped and read in chunks without loading the whole run.
+"""
+import numpy as np
+
+MAGIC = b"NBTRAJ1\0"
+
+
+def record_dtype(N):
+    """
+    The numpy dtype of a single snapshot record.
+
+    Parameters
+    ----------
+    N : int
+        The number of particles in the simulation.
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        Structured dtype with fields time, pos and vel.
+    """
+    return np.dtype([("time", "<f8"),
+                     ("pos", "<f8", (N, 3)),
+                     ("vel", "<f8", (N, 3))])
+
+
+class TrajectoryWriter:
+    """
+    Class to append snapshots of a simulation to a trajectory file.
+
+    Parameters
+    ----------
+    filename : str
+        The file to write the trajectory to.
+    masses : [float]
+        The mass of each particle.
+        Unit: kg
+    """
+    def __init__(self, filename, masses):
+        self.masses = np.asarray(masses, dtype="<f8")
+        self.N = len(self.masses)
+        self.dtype = record_dtype(self.N)
+        self.file = open(filename, "w+b")
+
+        self.file.write(MAGIC)
+        self.file.write(np.array(self.N, dtype="<i8").tobytes())
+        self.file.write(self.masses.tobytes())
+
+        self.offset = self.file.tell()  # Bytes before the first record
+        self.nrec = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def write(self, time, pos, vel):
+        """
+        Appends a single snapshot to the file.
+
+        Parameters
+        ----------
+        time : float
+            The simulation time of the snapshot.
+            Unit: s
+        pos : numpy.array (N, 3)
+            The position of each particle.
+            Unit: m
+        vel : numpy.array (N, 3)
+            The velocity of each particle.
+            Unit: m/s
+        """
+        record = np.empty(1, dtype=self.dtype)
+        record["time"] = time
+        record["pos"] = pos
+        record["vel"] = vel
+        self.file.write(record.tobytes())
+        self.nrec += 1
+
+
+    def write_particles(self, time, Plist):
+        """
+        Appends a snapshot of a list of particles to the file.
+        """
+        self.write(time, [p.pos for p in Plist], [p.vel for p in Plist])
+
+
+    def truncate(self, time):
+        """
+        Removes every snapshot after a time, so that the file stays in time
+        order when a simulation is rewound and run on.
+
+        Parameters
+        ----------
+        time : float
+            Unit: s
+        """
+        self.file.flush()
+
+        # Snapshots are in time order, so binary search for the first one
+        # after the time
+        lo, hi = 0, self.nrec
+        while lo < hi:
+            mid = (lo + hi) // 2
+            self.file.seek(self.offset + mid * self.dtype.itemsize)
+            if np.frombuffer(self.file.read(8), dtype="<f8")[0] <= time:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        self.nrec = lo
+        self.file.truncate(self.offset + lo * self.dtype.itemsize)
+        self.file.seek(0, 2)
+
+
+    def close(self):
+        self.file.close()
+
+
+def read_header(filename):
+    """
+    Reads the header of a trajectory file.
+
+    Parameters
+    ----------
+    filename : str
+        The trajectory file.
+
+    Returns
+    -------
+    masses : numpy.array (N,)
+        The mass of each particle.
+        Unit: kg
+    offset : int
+        The number of bytes before the first record.
+    nrec : int
+        The number of complete snapshots in the file.
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is not a trajectory file".format(filename))
+        N = int(np.frombuffer(f.read(8), dtype="<i8")[0])
+        masses = np.frombuffer(f.read(8 * N), dtype="<f8").copy()
+        offset = f.tell()
+        f.seek(0, 2)
+        size = f.tell()
+
+    nrec = (size - offset) // record_dtype(N).itemsize
+
+    return masses, offset, nrec
+
+
+def open_records(filename):
+    """
+    Memory maps all the snapshot records of a trajectory file.
+
+    Returns
+    -------
+    masses : numpy.array (N,)
+        The mass of each particle.
+        Unit: kg
+    records : numpy.memmap
+        Read only array of snapshot records.
+    """
+    masses, offset, nrec = read_header(filename)
+    records = np.memmap(filename, dtype=record_dtype(len(masses)), mode="r",
+                        offset=offset, shape=(nrec,))
+
+    return masses, records
+
+
+def read_chunks(filename, chunk=10000, start=0, stop=None):
+    """
+    Streams snapshots from a trajectory file in chunks.
+
+    Only one chunk is held in memory at a time.
+
+    Parameters
+    ----------
+    filename : str
+        The trajectory file.
+    chunk : int
+        The number of snapshots in each chunk.
+    start : int
+        The index of the first snapshot to read.
+    stop : int
+        One past the index of the last snapshot to read.
+        Default: the end of the file.
+
+    Yields
+    ------
+    time : numpy.array (k,)
+        Unit: s
+    pos : numpy.array (k, N, 3)
+        Unit: m
+    vel : numpy.array (k, N, 3)
+        Unit: m/s
+    """
+    _, records = open_records(filename)
+    if stop is None or stop > len(records):
+        stop = len(records)
+
+    for i in range(start, stop, chunk):
+        block = np.array(records[i:min(i + chunk, stop)])
+        yield block["time"], block["pos"], block["vel"]
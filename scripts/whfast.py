@@ -0,0 +1,363 @@
+"""
+Wisdom-Holman symplectic integrator in democratic heliocentric coordinates.
+
+For systems dominated by a central body (index 0), most of the motion of
+every other body is a Kepler orbit about it. The Hamiltonian is split into
+
+    Kepler      : each body orbiting the central body, solved exactly
+    Interaction : gravity between the non-central bodies, applied as kicks
+    Jump        : drift due to the motion of the central body
+
+and the step is kick - jump - Kepler - jump - kick. Because the Kepler part
+is solved exactly, the timestep only needs to resolve the interactions,
+so steps of a few percent of the innermost orbital period are accurate.
+
+Coordinates (democratic heliocentric):
+
+    Q_i = x_i - x_0   heliocentric positions of the bodies i >= 1
+    u_i = v_i - v_cm  barycentric velocities of the bodies i >= 1
+
+The centre of mass moves in a straight line and is tracked separately.
+
+To integrate the solar system for a thousand years, saving every 100 steps:
+
+`python whfast.py --years 1000 --every 100 --output solar.traj`
+
+With the default timestep (about 4.4 days) this is about 83 thousand
+steps. At roughly 1 ms per step in numpy that takes a minute or two, so
+a million years takes most of a day.
+"""
+import argparse
+
+import numpy as np
+
+import constants as C
+
+
+def stumpff(psi):
+    """
+    The Stumpff functions c2 and c3.
+
+    Parameters
+    ----------
+    psi : numpy.array
+        The argument, alpha * chi^2.
+
+    Returns
+    -------
+    c2, c3 : numpy.array
+    """
+    c2 = np.empty_like(psi)
+    c3 = np.empty_like(psi)
+
+    # Use the series near zero, where the closed forms lose precision
+    pos = psi > 0.1
+    neg = psi < -0.1
+    small = ~(pos | neg)
+
+    s = np.sqrt(psi[pos])
+    c2[pos] = (1 - np.cos(s)) / psi[pos]
+    c3[pos] = (s - np.sin(s)) / s**3
+
+    s = np.sqrt(-psi[neg])
+    c2[neg] = (np.cosh(s) - 1) / -psi[neg]
+    c3[neg] = (np.sinh(s) - s) / s**3
+
+    # c2 = sum (-psi)^k / (2k+2)!,  c3 = sum (-psi)^k / (2k+3)!
+    p = psi[small]
+    term2 = np.full_like(p, 1 / 2.)
+    term3 = np.full_like(p, 1 / 6.)
+    c2[small] = term2
+    c3[small] = term3
+    for k in range(1, 8):
+        term2 = term2 * -p / ((2 * k + 1) * (2 * k + 2))
+        term3 = term3 * -p / ((2 * k + 2) * (2 * k + 3))
+        c2[small] += term2
+        c3[small] += term3
+
+    return c2, c3
+
+
+def kepler_drift(r0, v0, mu, dt, tol=1e-13, maxiter=50):
+    """
+    Advances Kepler orbits by dt using universal variables.
+
+    Works for elliptic, parabolic and hyperbolic orbits, and solves for
+    every body at once.
+
+    Parameters
+    ----------
+    r0 : numpy.array (N, 3)
+        Positions relative to the central body.
+        Unit: m
+    v0 : numpy.array (N, 3)
+        Velocities relative to the central body.
+        Unit: m/s
+    mu : float or numpy.array (N,)
+        Gravitational parameter G * M of each orbit.
+        Unit: m^3/s^2
+    dt : float
+        Unit: s
+
+    Returns
+    -------
+    r, v : numpy.array (N, 3)
+        Positions and velocities after dt.
+    """
+    mu = np.broadcast_to(np.asarray(mu, dtype=float), (len(r0),))
+    rmag = np.linalg.norm(r0, axis=-1)
+    sqrt_mu = np.sqrt(mu)
+    sigma0 = np.sum(r0 * v0, axis=-1) / sqrt_mu
+    alpha = 2 / rmag - np.sum(v0**2, axis=-1) / mu
+
+    # Solve the universal Kepler equation for chi with Newton's method
+    chi = sqrt_mu * dt / rmag
+    for _ in range(maxiter):
+        psi = alpha * chi**2
+        c2, c3 = stumpff(psi)
+        chi2 = chi**2
+        F = (chi2 * chi * c3 + sigma0 * chi2 * c2
+             + rmag * chi * (1 - psi * c3) - sqrt_mu * dt)
+        r = chi2 * c2 + sigma0 * chi * (1 - psi * c3) + rmag * (1 - psi * c2)
+        dchi = F / r
+        chi = chi - dchi
+        if np.all(np.abs(dchi) <= tol * np.maximum(np.abs(chi), 1e-300)):
+            break
+
+    psi = alpha * chi**2
+    c2, c3 = stumpff(psi)
+    chi2 = chi**2
+    r = chi2 * c2 + sigma0 * chi * (1 - psi * c3) + rmag * (1 - psi * c2)
+
+    # Lagrange f and g functions
+    f = 1 - chi2 * c2 / rmag
+    g = dt - chi2 * chi * c3 / sqrt_mu
+    fdot = sqrt_mu * chi * (psi * c3 - 1) / (r * rmag)
+    gdot = 1 - chi2 * c2 / r
+
+    new_r = f[:, None] * r0 + g[:, None] * v0
+    new_v = fdot[:, None] * r0 + gdot[:, None] * v0
+
+    return new_r, new_v
+
+
+def to_democratic(pos, vel, masses):
+    """
+    Converts inertial positions and velocities to democratic heliocentric
+    coordinates.
+
+    Returns
+    -------
+    Q : numpy.array (N-1, 3)
+        Heliocentric positions of the non-central bodies.
+    u : numpy.array (N-1, 3)
+        Barycentric velocities of the non-central bodies.
+    xcm, vcm : numpy.array (3,)
+        Position and velocity of the centre of mass.
+    """
+    M = np.sum(masses)
+    xcm = masses @ pos / M
+    vcm = masses @ vel / M
+
+    return pos[1:] - pos[0], vel[1:] - vcm, xcm, vcm
+
+
+def from_democratic(Q, u, xcm, vcm, masses):
+    """
+    Converts democratic heliocentric coordinates back to inertial positions
+    and velocities.
+    """
+    M = np.sum(masses)
+    x0 = xcm - masses[1:] @ Q / M
+    v0 = vcm - masses[1:] @ u / masses[0]
+
+    pos = np.vstack([x0, Q + x0])
+    vel = np.vstack([v0, u + vcm])
+
+    return pos, vel
+
+
+def _jump(Q, u, masses, dt):
+    """
+    Drift of the heliocentric positions due to the central body's motion.
+    """
+    return Q + dt * (masses[1:] @ u) / masses[0]
+
+
+def _kepler(Q, u, masses, dt):
+    return kepler_drift(Q, u, C.XG * masses[0], dt)
+
+
+def step(pos, vel, masses, dt, accel):
+    """
+    Single Wisdom-Holman step. Two force evaluations.
+
+    Uses the same interface as the integrators in integrators.py, so it
+    converts to and from democratic heliocentric coordinates every step.
+    Use integrate for long runs.
+
+    Parameters
+    ----------
+    pos, vel : numpy.array (N, 3)
+        Inertial positions and velocities. Body 0 is the central body.
+    masses : numpy.array (N,)
+        Unit: kg
+    dt : float
+        Unit: s
+    accel : function
+        Force backend used for the interactions between the
+        non-central bodies.
+
+    Returns
+    -------
+    pos, vel : numpy.array (N, 3)
+    """
+    Q, u, xcm, vcm = to_democratic(pos, vel, masses)
+
+    u = u + 0.5 * dt * accel(Q, masses[1:])
+    Q = _jump(Q, u, masses, 0.5 * dt)
+    Q, u = _kepler(Q, u, masses, dt)
+    Q = _jump(Q, u, masses, 0.5 * dt)
+    u = u + 0.5 * dt * accel(Q, masses[1:])
+
+    return from_democratic(Q, u, xcm + dt * vcm, vcm, masses)
+
+
+def integrate(pos, vel, masses, dt, nsteps, accel, callback=None, every=1):
+    """
+    Integrates a system for many Wisdom-Holman steps.
+
+    Stays in democratic heliocentric coordinates for the whole run and
+    combines the closing and opening kicks of neighbouring steps, so each
+    step costs one force evaluation.
+
+    Parameters
+    ----------
+    pos, vel : numpy.array (N, 3)
+        Inertial positions and velocities. Body 0 is the central body.
+    masses : numpy.array (N,)
+        Unit: kg
+    dt : float
+        Unit: s
+    nsteps : int
+        The number of steps to take.
+    accel : function
+        Force backend used for the interactions between the
+        non-central bodies.
+    callback : function
+        Called as callback(step, pos, vel) every `every` steps with the
+        inertial state.
+    every : int
+        The number of steps between calls to callback.
+
+    Returns
+    -------
+    pos, vel : numpy.array (N, 3)
+        The final state.
+    """
+    Q, u, xcm, vcm = to_democratic(pos, vel, masses)
+    planets = masses[1:]
+
+    u = u + 0.5 * dt * accel(Q, planets)
+    for k in range(1, nsteps + 1):
+        Q = _jump(Q, u, masses, 0.5 * dt)
+        Q, u = _kepler(Q, u, masses, dt)
+        Q = _jump(Q, u, masses, 0.5 * dt)
+        a = accel(Q, planets)
+
+        if callback is not None and k % every == 0:
+            # Close the step with a half kick to synchronise the velocities
+            callback(k, *from_democratic(Q, u + 0.5 * dt * a,
+                                         xcm + k * dt * vcm, vcm, masses))
+
+        u = u + (dt if k < nsteps else 0.5 * dt) * a
+
+    return from_democratic(Q, u, xcm + nsteps * dt * vcm, vcm, masses)
+
+
+def innermost_period(pos, vel, masses):
+    """
+    The shortest Kepler period of the bodies about the central body.
+
+    Unbound bodies are ignored.
+
+    Returns
+    -------
+    period : float
+        Unit: s
+    """
+    r = np.linalg.norm(pos[1:] - pos[0], axis=-1)
+    v2 = np.sum((vel[1:] - vel[0])**2, axis=-1)
+    mu = C.XG * (masses[0] + masses[1:])
+    alpha = 2 / r - v2 / mu
+
+    bound = alpha > 0
+    if not np.any(bound):
+        raise ValueError("No bodies are bound to the central body")
+
+    return np.min(2 * np.pi / np.sqrt(mu[bound] * alpha[bound]**3))
+
+
+def timestep(pos, vel, masses, fraction=0.05):
+    """
+    A timestep that is a fraction of the innermost orbital period.
+
+    Unit: s
+    """
+    return fraction * innermost_period(pos, vel, masses)
+
+
+def read_args():
+    """
+    Read the arguments specified by the user.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", help="The length of the integration. \
+                        Unit: years, Default: 1000", type=float, default=1000)
+    parser.add_argument("--fraction", help="The timestep as a fraction of \
+                        the innermost orbital period. Default: 0.05",
+                        type=float, default=0.05)
+    parser.add_argument("--every", help="The number of steps between \
+                        snapshots. Default: 100", type=int, default=100)
+    parser.add_argument("--output", help="Write snapshots to this binary \
+                        trajectory file. Default: None")
+
+    return parser.parse_args()
+
+
+def main():
+
+    # Imported here as integrators.py imports this module
+    import integrators
+    import systems
+    from trajectory import TrajectoryWriter
+
+    args = read_args()
+
+    pos, vel, masses = systems.solar_system()
+    dt = timestep(pos, vel, masses, args.fraction)
+    nsteps = int(np.ceil(args.years * C.XYR / dt))
+
+    writer = None
+    if args.output:
+        writer = TrajectoryWriter(args.output, masses)
+        writer.write(0, pos, vel)
+
+    def snapshot(k, pos, vel):
+        if writer:
+            writer.write(k * dt, pos, vel)
+
+    E0 = integrators.energy(pos, vel, masses)
+    pos, vel = integrate(pos, vel, masses, dt, nsteps,
+                         integrators.accel_vectorized, snapshot, args.every)
+    E = integrators.energy(pos, vel, masses)
+
+    if writer:
+        writer.close()
+
+    print("{0} steps of {1:.3f} days, relative energy error {2:.3e}".format(
+          nsteps, dt / C.XDAY, abs((E - E0) / E0)))
+
+
+if __name__ == '__main__':
+    main()